@@ -0,0 +1,222 @@
+"""Shared NuGet client used by the stage3/stage4/stage5 CLIs.
+
+Collects everything the stages previously duplicated: the keep-alive HTTP
+layer with retry and on-disk caching, SemVer-aware latest-version picking,
+and streaming nuspec dependency extraction.
+"""
+
+import json
+import functools
+import hashlib
+import http.client
+import io
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+import os
+
+try:
+    # Optional accelerator: lxml's C parser is noticeably faster on nuspec
+    # documents. The stdlib parser stays the default so the tool keeps
+    # working without any third-party packages installed.
+    from lxml import etree as ET
+except ImportError:
+    from xml.etree import ElementTree as ET
+
+try:
+    # Optional accelerator: orjson parses the NuGet JSON indexes several
+    # times faster than the stdlib json module. Same fallback policy as lxml.
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+NUGET_SERVICE_INDEX = "https://api.nuget.org/v3/index.json"
+# The @type values that mark a flat-container resource; a set so the scan
+# below stays O(1) per resource even if aliases are added.
+PACKAGE_CONTENT_TYPES = frozenset({"PackageBaseAddress/3.0.0"})
+# Flat-container addresses of well-known feeds; resolving them through the
+# service index would cost an extra round-trip per run for a value that is
+# documented as stable.
+KNOWN_PACKAGE_BASE_URLS = {
+    "https://api.nuget.org/v3/index.json": "https://api.nuget.org/v3-flatcontainer/",
+}
+HTTP_TIMEOUT = 10
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.2  # seconds, doubled on each retry
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+MAX_REDIRECTS = 5
+# Worker count doubles as the per-server connection cap (one keep-alive
+# socket per worker thread), well under NuGet's 64-per-server limit.
+MAX_WORKERS = 16
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "konfupr2")
+VERSIONS_TTL = 300  # seconds; version indexes gain entries over time
+
+NUSPEC_NS = 'http://schemas.microsoft.com/packaging/2013/05/nuspec.xsd'
+_DEPENDENCIES_TAG = f'{{{NUSPEC_NS}}}dependencies'
+_DEPENDENCY_TAG = f'{{{NUSPEC_NS}}}dependency'
+
+# One keep-alive connection per (scheme, host), reused across all fetches
+# so repeated NuGet calls skip the TCP+TLS handshake. Connections live in
+# thread-local storage because http.client connections are not thread-safe:
+# each worker thread keeps its own socket.
+_connections = threading.local()
+
+
+def _http_get(url: str, _redirects: int = 0) -> bytes:
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    key = (parts.scheme, parts.netloc)
+    pool = _connections.__dict__.setdefault("by_host", {})
+    for attempt in range(RETRY_TOTAL + 1):
+        conn = pool.get(key)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            conn = conn_class(parts.netloc, timeout=HTTP_TIMEOUT)
+            pool[key] = conn
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            # Stale keep-alive connection or transient network failure:
+            # drop the socket and retry on a fresh one after a backoff.
+            conn.close()
+            pool.pop(key, None)
+            if attempt == RETRY_TOTAL:
+                raise
+            time.sleep(RETRY_BACKOFF * (2 ** attempt))
+            continue
+        if response.status in (301, 302, 307, 308):
+            location = response.getheader("Location")
+            if not location:
+                raise RuntimeError(f"HTTP {response.status} without Location header for {url}")
+            if _redirects >= MAX_REDIRECTS:
+                raise RuntimeError(f"Too many redirects (>{MAX_REDIRECTS}) for {url}")
+            # Location may be relative; resolve it against the current URL.
+            return _http_get(urljoin(url, location), _redirects + 1)
+        if response.status in RETRY_STATUSES and attempt < RETRY_TOTAL:
+            # Throttling or a server-side hiccup; back off and try again,
+            # waiting at least as long as the server's Retry-After asks.
+            delay = RETRY_BACKOFF * (2 ** attempt)
+            retry_after = response.getheader("Retry-After")
+            if retry_after:
+                try:
+                    delay = max(delay, int(retry_after))
+                except ValueError:
+                    pass  # HTTP-date form; keep the computed backoff
+            time.sleep(delay)
+            continue
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status} for {url}")
+        return body
+    raise RuntimeError(f"HTTP request failed after {RETRY_TOTAL + 1} attempts: {url}")
+
+
+def _cached_http_get(url: str, ttl=None) -> bytes:
+    # NuGet flat-container content is immutable per (id, version), so
+    # responses are cached on disk across runs; ttl=None marks a URL as
+    # immutable, mutable URLs (version indexes) expire after `ttl` seconds.
+    path = os.path.join(CACHE_DIR, hashlib.sha1(url.encode('utf-8')).hexdigest())
+    try:
+        if ttl is None or time.time() - os.path.getmtime(path) < ttl:
+            with open(path, 'rb') as f:
+                return f.read()
+    except OSError:
+        pass
+    body = _http_get(url)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+    return body
+
+
+def fetch_json(url: str, ttl=None) -> dict:
+    return _json_loads(_cached_http_get(url, ttl))
+
+
+@functools.lru_cache(maxsize=1)
+def get_nuget_base_url() -> str:
+    known = KNOWN_PACKAGE_BASE_URLS.get(NUGET_SERVICE_INDEX)
+    if known:
+        return known
+    index = fetch_json(NUGET_SERVICE_INDEX, ttl=VERSIONS_TTL)
+    base_url = next(
+        (resource["@id"] for resource in index.get("resources", [])
+         if resource.get("@type") in PACKAGE_CONTENT_TYPES),
+        None,
+    )
+    if base_url is None:
+        raise RuntimeError("NuGet PackageBaseAddress not found.")
+    return base_url
+
+
+def _semver_key(version: str):
+    # SemVer 2.0 precedence for picking the latest version: numeric core
+    # parts compare as integers (so 1.10.0 > 1.9.0, unlike a lexical max),
+    # any release outranks its own pre-releases, and pre-release
+    # identifiers compare numerically when numeric, lexically otherwise.
+    version = version.split('+', 1)[0]
+    core, _, prerelease = version.partition('-')
+    numbers = []
+    for part in core.split('.'):
+        try:
+            numbers.append(int(part))
+        except ValueError:
+            numbers.append(0)
+    if not prerelease:
+        identifiers = ((2, 0, ''),)
+    else:
+        identifiers = tuple(
+            (0, int(ident), '') if ident.isdigit() else (1, 0, ident)
+            for ident in prerelease.split('.')
+        )
+    return (tuple(numbers), identifiers)
+
+
+@functools.lru_cache(maxsize=4096)
+def get_latest_version(base_url: str, package_id: str) -> str:
+    package_id_lower = package_id.lower()
+    versions_url = f"{base_url.rstrip('/')}/{package_id_lower}/index.json"
+    data = fetch_json(versions_url, ttl=VERSIONS_TTL)
+    versions = data.get("versions", [])
+    if not versions:
+        raise RuntimeError(f"No versions found for package '{package_id}'")
+    return max(versions, key=_semver_key)
+
+
+def extract_dependencies(nuspec_bytes: bytes) -> list:
+    # iterparse walks the document once without keeping the whole tree in
+    # memory: only dependency ids are collected and every finished element
+    # is cleared, so memory stays flat even for very large nuspec files.
+    # Both grouped and flat <dependency> entries are picked up in document
+    # order.
+    seen = set()
+    deps = []
+    inside_dependencies = 0
+    for event, elem in ET.iterparse(io.BytesIO(nuspec_bytes), events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == _DEPENDENCIES_TAG:
+                inside_dependencies += 1
+            continue
+        if elem.tag == _DEPENDENCIES_TAG:
+            inside_dependencies -= 1
+        elif inside_dependencies and elem.tag == _DEPENDENCY_TAG:
+            dep_id = elem.get('id')
+            if dep_id and dep_id not in seen:
+                seen.add(dep_id)
+                deps.append(dep_id)
+        elem.clear()
+    return deps
+
+
+@functools.lru_cache(maxsize=4096)
+def get_nuget_direct_deps(package_id: str) -> list:
+    base_url = get_nuget_base_url()
+    version = get_latest_version(base_url, package_id)
+    package_id_lower = package_id.lower()
+    nuspec_url = f"{base_url.rstrip('/')}/{package_id_lower}/{version}/{package_id_lower}.nuspec"
+    return extract_dependencies(_cached_http_get(nuspec_url))
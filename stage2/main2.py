@@ -1,12 +1,20 @@
 import argparse
+import io
 import sys
-import json
-import urllib.request
-from urllib.parse import urljoin
-from xml.etree import ElementTree as ET
+import os
 
-NUGET_SERVICE_INDEX = "https://api.nuget.org/v3/index.json"
-PACKAGE_CONTENT_TYPE = "PackageBaseAddress/3.0.0"
+# The stage scripts run from their own folder (see the .bat tests), so the
+# shared client module at the repo root is put on the import path by hand.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nuget_client import (
+    ET,
+    _DEPENDENCIES_TAG,
+    _DEPENDENCY_TAG,
+    _cached_http_get,
+    get_latest_version,
+    get_nuget_base_url,
+)
 
 
 def validate_package_name(name: str) -> str:
@@ -25,86 +33,38 @@ def validate_max_depth(depth_str: str) -> int:
     return depth
 
 
-def fetch_json(url: str) -> dict:
-    try:
-        with urllib.request.urlopen(url) as response:
-            return json.loads(response.read().decode('utf-8'))
-    except Exception as e:
-        raise RuntimeError(f"Failed to fetch JSON from {url}: {e}")
-
-
-def fetch_xml(url: str) -> ET.Element:
-    try:
-        with urllib.request.urlopen(url) as response:
-            return ET.fromstring(response.read().decode('utf-8'))
-    except Exception as e:
-        raise RuntimeError(f"Failed to fetch or parse XML from {url}: {e}")
-
-
-def get_nuget_base_url() -> str:
-
-    index = fetch_json(NUGET_SERVICE_INDEX)
-    for resource in index.get("resources", []):
-        if resource.get("@type") == PACKAGE_CONTENT_TYPE:
-            return resource["@id"]
-    raise RuntimeError("NuGet PackageBaseAddress not found in service index.")
-
-
-def get_latest_version(base_url: str, package_id: str) -> str:
-
-    package_id_lower = package_id.lower()
-    versions_url = f"{base_url.rstrip('/')}/{package_id_lower}/index.json"
-    data = fetch_json(versions_url)
-    versions = data.get("versions", [])
-    if not versions:
-        raise RuntimeError(f"No versions found for package '{package_id}'")
-    return max(versions)
-
-
-def extract_dependencies(nuspec_root: ET.Element, package_id: str) -> list:
-
-    ns = {'ns': 'http://schemas.microsoft.com/packaging/2013/05/nuspec.xsd'}
-    metadata = nuspec_root.find('ns:metadata', ns)
-    if metadata is None:
-        return []
-
-    deps_groups = metadata.find('ns:dependencies', ns)
-    if deps_groups is None:
-        return []
-
+def extract_dependencies(nuspec_bytes: bytes) -> list:
+    # Same single-pass iterparse walk as nuget_client.extract_dependencies,
+    # kept local because stage2 reports {'id', 'version'} pairs while the
+    # later stages only need the bare ids.
     seen = set()
     dependencies = []
-
-    def add_dep(dep_id: str, dep_version: str):
-        key = (dep_id, dep_version)
-        if key not in seen:
-            seen.add(key)
-            dependencies.append({'id': dep_id, 'version': dep_version})
-
-    for group in deps_groups.findall('ns:group', ns):
-        for dep in group.findall('ns:dependency', ns):
-            dep_id = dep.get('id')
-            dep_version = dep.get('version', '*')
+    inside_dependencies = 0
+    for event, elem in ET.iterparse(io.BytesIO(nuspec_bytes), events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == _DEPENDENCIES_TAG:
+                inside_dependencies += 1
+            continue
+        if elem.tag == _DEPENDENCIES_TAG:
+            inside_dependencies -= 1
+        elif inside_dependencies and elem.tag == _DEPENDENCY_TAG:
+            dep_id = elem.get('id')
             if dep_id:
-                add_dep(dep_id, dep_version)
-
-    for dep in deps_groups.findall('ns:dependency', ns):
-        dep_id = dep.get('id')
-        dep_version = dep.get('version', '*')
-        if dep_id:
-            add_dep(dep_id, dep_version)
-
+                dep_version = elem.get('version', '*')
+                key = (dep_id, dep_version)
+                if key not in seen:
+                    seen.add(key)
+                    dependencies.append({'id': dep_id, 'version': dep_version})
+        elem.clear()
     return dependencies
 
+
 def get_direct_dependencies(package_id: str) -> list:
     base_url = get_nuget_base_url()
     version = get_latest_version(base_url, package_id)
     package_id_lower = package_id.lower()
     nuspec_url = f"{base_url.rstrip('/')}/{package_id_lower}/{version}/{package_id_lower}.nuspec"
-
-    root = fetch_xml(nuspec_url)
-    deps = extract_dependencies(root, package_id)
-    return deps
+    return extract_dependencies(_cached_http_get(nuspec_url))
 
 
 def parse_arguments():
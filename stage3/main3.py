@@ -1,14 +1,13 @@
 import argparse
 import sys
 import json
-import urllib.request
-from urllib.parse import urljoin
-from xml.etree import ElementTree as ET
 import os
 
+# The stage scripts run from their own folder (see the .bat tests), so the
+# shared client module at the repo root is put on the import path by hand.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-NUGET_SERVICE_INDEX = "https://api.nuget.org/v3/index.json"
-PACKAGE_CONTENT_TYPE = "PackageBaseAddress/3.0.0"
+from nuget_client import get_nuget_direct_deps
 
 
 def validate_package_name(name: str) -> str:
@@ -25,75 +24,13 @@ def validate_max_depth(depth_str: str) -> int:
         raise ValueError("Max depth must be non-negative.")
     return depth
 
-def should_skip_package(pkg_name: str, filter_substring: str) -> bool:
+def make_skip_filter(filter_substring: str):
+    # Bind the substring once per run: the per-package check collapses to
+    # a single str containment test instead of re-checking for an empty
+    # filter on every call.
     if not filter_substring:
-        return False
-    return filter_substring in pkg_name
-
-
-def fetch_json(url: str) -> dict:
-    with urllib.request.urlopen(url) as response:
-        return json.loads(response.read().decode('utf-8'))
-
-def fetch_xml(url: str) -> ET.Element:
-    with urllib.request.urlopen(url) as response:
-        return ET.fromstring(response.read().decode('utf-8'))
-
-def get_nuget_base_url() -> str:
-    index = fetch_json(NUGET_SERVICE_INDEX)
-    for resource in index.get("resources", []):
-        if resource.get("@type") == PACKAGE_CONTENT_TYPE:
-            return resource["@id"]
-    raise RuntimeError("NuGet PackageBaseAddress not found.")
-
-def get_latest_version(base_url: str, package_id: str) -> str:
-    package_id_lower = package_id.lower()
-    versions_url = f"{base_url.rstrip('/')}/{package_id_lower}/index.json"
-    data = fetch_json(versions_url)
-    versions = data.get("versions", [])
-    if not versions:
-        raise RuntimeError(f"No versions found for package '{package_id}'")
-    return max(versions)
-
-def extract_dependencies(nuspec_root: ET.Element) -> list:
-    ns = {'ns': 'http://schemas.microsoft.com/packaging/2013/05/nuspec.xsd'}
-    metadata = nuspec_root.find('ns:metadata', ns)
-    if metadata is None:
-        return []
-
-    deps_groups = metadata.find('ns:dependencies', ns)
-    if deps_groups is None:
-        return []
-
-    seen = set()
-    deps = []
-
-    def add(dep_id, dep_version):
-        key = (dep_id, dep_version)
-        if key not in seen:
-            seen.add(key)
-            deps.append(dep_id)
-
-    for group in deps_groups.findall('ns:group', ns):
-        for dep in group.findall('ns:dependency', ns):
-            dep_id = dep.get('id')
-            if dep_id:
-                add(dep_id, dep.get('version', ''))
-
-    for dep in deps_groups.findall('ns:dependency', ns):
-        dep_id = dep.get('id')
-        if dep_id:
-            add(dep_id, dep.get('version', ''))
-
-    return deps
-
-def get_nuget_direct_deps(package_id: str) -> list:
-    base_url = get_nuget_base_url()
-    version = get_latest_version(base_url, package_id)
-    package_id_lower = package_id.lower()
-    nuspec_url = f"{base_url}/{package_id_lower}/{version}/{package_id_lower}.nuspec"
-    root = fetch_xml(nuspec_url)
-    return extract_dependencies(root)
+        return lambda pkg_name: False
+    return lambda pkg_name: filter_substring in pkg_name
 
 
 def load_test_repo(repo_path: str) -> dict:
@@ -111,53 +48,70 @@ def get_test_direct_deps(package_id: str, test_repo: dict) -> list:
 
 
 def dfs_build_graph(
-    current: str,
-    depth: int,
+    root: str,
     max_depth: int,
     filter_substring: str,
-    visited_path: set,
     graph: dict,
     get_deps_func,
     **kwargs
 ):
-    if depth > max_depth:
-        return
-
-    if should_skip_package(current, filter_substring):
-        return
-
-    if current in visited_path:
-        return
-
-    if current not in graph:
-        graph[current] = []
-
-    try:
-        direct_deps = get_deps_func(current, **kwargs)
-    except Exception as e:
-        print(f"Warning: failed to fetch dependencies for '{current}': {e}", file=sys.stderr)
-        return
-
-    filtered_deps = [
-        dep for dep in direct_deps
-        if not should_skip_package(dep, filter_substring)
-    ]
-
-    graph[current] = filtered_deps
-
-    new_visited = visited_path | {current}
-    for dep in filtered_deps:
-        if dep not in graph or depth + 1 <= max_depth:
-            dfs_build_graph(
-                dep,
-                depth + 1,
-                max_depth,
-                filter_substring,
-                new_visited,
-                graph,
-                get_deps_func,
-                **kwargs
-            )
+    should_skip = make_skip_filter(filter_substring)
+
+    # Explicit stack instead of recursion: no Python frame per node and no
+    # RecursionError risk on deep dependency chains.
+    #
+    # The current DFS path is one mutable set updated in place: entering a
+    # node adds it and schedules a _LEAVE marker that removes it once the
+    # whole subtree has been walked. This avoids allocating a frozenset
+    # copy of the path for every visited node.
+    _LEAVE = object()
+    stack = [(root, 0)]
+    path = set()
+    # Shallowest depth at which each node was already expanded. A node is
+    # only worth revisiting when reached at a smaller depth, where the
+    # depth limit lets more of its subtree through; everything else is
+    # duplicate work.
+    expanded_depth = {}
+    while stack:
+        current, depth = stack.pop()
+
+        if depth is _LEAVE:
+            path.remove(current)
+            continue
+
+        if depth > max_depth:
+            continue
+
+        if should_skip(current):
+            continue
+
+        if current in path:
+            continue
+
+        if expanded_depth.get(current, max_depth + 1) <= depth:
+            continue
+        expanded_depth[current] = depth
+
+        if current not in graph:
+            graph[current] = []
+
+        try:
+            direct_deps = get_deps_func(current, **kwargs)
+        except Exception as e:
+            print(f"Warning: failed to fetch dependencies for '{current}': {e}", file=sys.stderr)
+            continue
+
+        filtered_deps = [
+            dep for dep in direct_deps
+            if not should_skip(dep)
+        ]
+
+        graph[current] = filtered_deps
+
+        path.add(current)
+        stack.append((current, _LEAVE))
+        for dep in reversed(filtered_deps):
+            stack.append((dep, depth + 1))
 
 
 
@@ -205,22 +159,18 @@ def main():
     if config["mode"] == "test":
         test_repo = load_test_repo(config["repo"])
         dfs_build_graph(
-            current=config["package"],
-            depth=0,
+            root=config["package"],
             max_depth=config["max_depth"],
             filter_substring=config["filter"],
-            visited_path=set(),
             graph=graph,
             get_deps_func=get_test_direct_deps,
             test_repo=test_repo
         )
     else:
         dfs_build_graph(
-            current=config["package"],
-            depth=0,
+            root=config["package"],
             max_depth=config["max_depth"],
             filter_substring=config["filter"],
-            visited_path=set(),
             graph=graph,
             get_deps_func=get_nuget_direct_deps
         )
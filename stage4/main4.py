@@ -1,13 +1,15 @@
 import argparse
 import sys
 import json
-import urllib.request
-from urllib.parse import urljoin
-from xml.etree import ElementTree as ET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os
 
-NUGET_SERVICE_INDEX = "https://api.nuget.org/v3/index.json"
-PACKAGE_CONTENT_TYPE = "PackageBaseAddress/3.0.0"
+# The stage scripts run from their own folder (see the .bat tests), so the
+# shared client module at the repo root is put on the import path by hand.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nuget_client import MAX_WORKERS, get_nuget_direct_deps
 
 def validate_package_name(name: str) -> str:
     if not name or not name.strip():
@@ -23,75 +25,13 @@ def validate_max_depth(depth_str: str) -> int:
         raise ValueError("Max depth must be non-negative.")
     return depth
 
-def should_skip_package(pkg_name: str, filter_substring: str) -> bool:
+def make_skip_filter(filter_substring: str):
+    # Bind the substring once per run: the per-package check collapses to
+    # a single str containment test instead of re-checking for an empty
+    # filter on every call.
     if not filter_substring:
-        return False
-    return filter_substring in pkg_name
-
-
-def fetch_json(url: str) -> dict:
-    with urllib.request.urlopen(url) as response:
-        return json.loads(response.read().decode('utf-8'))
-
-def fetch_xml(url: str) -> ET.Element:
-    with urllib.request.urlopen(url) as response:
-        return ET.fromstring(response.read().decode('utf-8'))
-
-def get_nuget_base_url() -> str:
-    index = fetch_json(NUGET_SERVICE_INDEX)
-    for resource in index.get("resources", []):
-        if resource.get("@type") == PACKAGE_CONTENT_TYPE:
-            return resource["@id"]
-    raise RuntimeError("NuGet PackageBaseAddress not found.")
-
-def get_latest_version(base_url: str, package_id: str) -> str:
-    package_id_lower = package_id.lower()
-    versions_url = f"{base_url.rstrip('/')}/{package_id_lower}/index.json"
-    data = fetch_json(versions_url)
-    versions = data.get("versions", [])
-    if not versions:
-        raise RuntimeError(f"No versions found for package '{package_id}'")
-    return max(versions)
-
-def extract_dependencies(nuspec_root: ET.Element) -> list:
-    ns = {'ns': 'http://schemas.microsoft.com/packaging/2013/05/nuspec.xsd'}
-    metadata = nuspec_root.find('ns:metadata', ns)
-    if metadata is None:
-        return []
-
-    deps_groups = metadata.find('ns:dependencies', ns)
-    if deps_groups is None:
-        return []
-
-    seen = set()
-    deps = []
-
-    def add(dep_id, dep_version):
-        key = (dep_id, dep_version)
-        if key not in seen:
-            seen.add(key)
-            deps.append(dep_id)  # Only name needed for graph
-
-    for group in deps_groups.findall('ns:group', ns):
-        for dep in group.findall('ns:dependency', ns):
-            dep_id = dep.get('id')
-            if dep_id:
-                add(dep_id, dep.get('version', ''))
-
-    for dep in deps_groups.findall('ns:dependency', ns):
-        dep_id = dep.get('id')
-        if dep_id:
-            add(dep_id, dep.get('version', ''))
-
-    return deps
-
-def get_nuget_direct_deps(package_id: str) -> list:
-    base_url = get_nuget_base_url()
-    version = get_latest_version(base_url, package_id)
-    package_id_lower = package_id.lower()
-    nuspec_url = f"{base_url}/{package_id_lower}/{version}/{package_id_lower}.nuspec"
-    root = fetch_xml(nuspec_url)
-    return extract_dependencies(root)
+        return lambda pkg_name: False
+    return lambda pkg_name: filter_substring in pkg_name
 
 
 def load_test_repo(repo_path: str) -> dict:
@@ -108,87 +48,75 @@ def get_test_direct_deps(package_id: str, test_repo: dict) -> list:
     return test_repo.get(package_id, [])
 
 
-def dfs_build_graph(
-    current: str,
-    depth: int,
+def bfs_build_graph(
+    root: str,
     max_depth: int,
     filter_substring: str,
-    visited_path: set,
     graph: dict,
     get_deps_func,
     **kwargs
 ):
-    if depth > max_depth:
-        return
-
-    if should_skip_package(current, filter_substring):
+    should_skip = make_skip_filter(filter_substring)
+    if should_skip(root):
         return
 
-    if current in visited_path:
-        return
-
-    if current not in graph:
-        graph[current] = []
-
-    try:
-        direct_deps = get_deps_func(current, **kwargs)
-    except Exception as e:
-        print(f"⚠️ Warning: failed to fetch dependencies for '{current}': {e}", file=sys.stderr)
-        return
-
-    filtered_deps = [
-        dep for dep in direct_deps
-        if not should_skip_package(dep, filter_substring)
-    ]
-
-    graph[current] = filtered_deps
-
-    new_visited = visited_path | {current}
-    for dep in filtered_deps:
-        if dep not in graph or depth + 1 <= max_depth:
-            dfs_build_graph(
-                dep,
-                depth + 1,
-                max_depth,
-                filter_substring,
-                new_visited,
-                graph,
-                get_deps_func,
-                **kwargs
-            )
+    def fetch_deps(pkg):
+        try:
+            return get_deps_func(pkg, **kwargs)
+        except Exception as e:
+            print(f"⚠️ Warning: failed to fetch dependencies for '{pkg}': {e}", file=sys.stderr)
+            return []
+
+    # Level-synchronous BFS: all packages of one frontier are fetched
+    # concurrently, so wall-clock cost is one round-trip per depth level
+    # instead of one per package.
+    frontier = [root]
+    depth = 0
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        while frontier and depth <= max_depth:
+            results = list(executor.map(fetch_deps, frontier))
+
+            for pkg, direct_deps in zip(frontier, results):
+                graph[pkg] = [
+                    dep for dep in direct_deps
+                    if not should_skip(dep)
+                ]
+
+            next_frontier = []
+            queued = set()
+            for pkg in frontier:
+                for dep in graph[pkg]:
+                    if dep not in graph and dep not in queued:
+                        queued.add(dep)
+                        next_frontier.append(dep)
+
+            frontier = next_frontier
+            depth += 1
 
 
 def topological_sort(graph: dict) -> list:
-    WHITE, GRAY, BLACK = 0, 1, 2
-    color = {node: WHITE for node in graph}
+    # Kahn's algorithm: iterative, O(V + E), no recursion depth limit.
+    # A node's in-degree counts its dependencies present in the graph.
+    # Nodes that never reach in-degree zero sit in (or depend on) a cycle
+    # and are left out of the order, matching the old DFS behavior.
+    in_degree = {node: 0 for node in graph}
+    dependents = {node: [] for node in graph}
+    for node, deps in graph.items():
+        for dep in deps:
+            if dep in in_degree:
+                in_degree[node] += 1
+                dependents[dep].append(node)
+
+    queue = deque(node for node, degree in in_degree.items() if degree == 0)
     result = []
-    in_cycle = set()
-
-    def dfs(node):
-        if color[node] == GRAY:
-            in_cycle.add(node)
-            return False
-        if color[node] == BLACK:
-            return True
-
-        color[node] = GRAY
-        for dep in graph.get(node, []):
-            if dep not in graph:
-                continue
-            if not dfs(dep):
-                in_cycle.add(node)
-                color[node] = WHITE
-                return False
-        color[node] = BLACK
+    while queue:
+        node = queue.popleft()
         result.append(node)
-        return True
-
-    for node in graph:
-        if color[node] == WHITE:
-            dfs(node)
-
-    safe_order = [node for node in result if node not in in_cycle]
-    return safe_order
+        for dependent in dependents[node]:
+            in_degree[dependent] -= 1
+            if in_degree[dependent] == 0:
+                queue.append(dependent)
+    return result
 
 
 
@@ -236,23 +164,19 @@ def main():
 
     if config["mode"] == "test":
         test_repo = load_test_repo(config["repo"])
-        dfs_build_graph(
-            current=config["package"],
-            depth=0,
+        bfs_build_graph(
+            root=config["package"],
             max_depth=config["max_depth"],
             filter_substring=config["filter"],
-            visited_path=set(),
             graph=graph,
             get_deps_func=get_test_direct_deps,
             test_repo=test_repo
         )
     else:
-        dfs_build_graph(
-            current=config["package"],
-            depth=0,
+        bfs_build_graph(
+            root=config["package"],
             max_depth=config["max_depth"],
             filter_substring=config["filter"],
-            visited_path=set(),
             graph=graph,
             get_deps_func=get_nuget_direct_deps
         )
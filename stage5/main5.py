@@ -1,11 +1,16 @@
 import argparse
 import sys
 import json
-import urllib.request
-import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
 import os
 
+# The stage scripts run from their own folder (see the .bat tests), so the
+# shared client module at the repo root is put on the import path by hand.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nuget_client import MAX_WORKERS, get_nuget_direct_deps
 
 def validate_package_name(name: str) -> str:
     if not name or not name.strip():
@@ -23,43 +28,13 @@ def validate_max_depth(depth_str: str) -> int:
     return depth
 
 
-def should_skip_package(pkg_name: str, filter_substring: str) -> bool:
+def make_skip_filter(filter_substring: str):
+    # Bind the substring once per run: the per-package check collapses to
+    # a single str containment test instead of re-checking for an empty
+    # filter on every call.
     if not filter_substring:
-        return False
-    return filter_substring in pkg_name
-
-
-def get_nuget_direct_deps(package_id: str) -> list:
-    try:
-        package_id_lower = package_id.lower()
-        versions_url = f"https://api.nuget.org/v3-flatcontainer/{package_id_lower}/index.json"
-        with urllib.request.urlopen(versions_url) as r:
-            versions = json.loads(r.read().decode())["versions"]
-        version = max(versions)
-        nuspec_url = f"https://api.nuget.org/v3-flatcontainer/{package_id_lower}/{version}/{package_id_lower}.nuspec"
-        with urllib.request.urlopen(nuspec_url) as r:
-            root = ET.fromstring(r.read().decode())
-        ns = {'ns': 'http://schemas.microsoft.com/packaging/2013/05/nuspec.xsd'}
-        metadata = root.find('ns:metadata', ns)
-        if metadata is None:
-            return []
-        deps_node = metadata.find('ns:dependencies', ns)
-        if deps_node is None:
-            return []
-        deps = []
-        for group in deps_node.findall('ns:group', ns):
-            for dep in group.findall('ns:dependency', ns):
-                i = dep.get('id')
-                if i and i not in deps:
-                    deps.append(i)
-        for dep in deps_node.findall('ns:dependency', ns):
-            i = dep.get('id')
-            if i and i not in deps:
-                deps.append(i)
-        return deps
-    except Exception as e:
-        print(f"  Error: {e}")
-        return []
+        return lambda pkg_name: False
+    return lambda pkg_name: filter_substring in pkg_name
 
 
 def load_test_repo(repo_path: str) -> dict:
@@ -77,85 +52,99 @@ def get_test_direct_deps(package_id: str, test_repo: dict) -> list:
     return test_repo.get(package_id, [])
 
 
-def dfs_build_graph(current: str, depth: int, max_depth: int, filter_substring: str, visited_path: set, graph: dict,
-                    processed: set, get_deps_func, **kwargs):
-    if depth > max_depth:
-        return
-    if should_skip_package(current, filter_substring):
+def bfs_build_graph(root: str, max_depth: int, filter_substring: str, graph: dict, get_deps_func, **kwargs):
+    should_skip = make_skip_filter(filter_substring)
+    if should_skip(root):
         return
-    if current in visited_path:
-        return
-    if current in processed:
-        return
-
-    print(f"Processing: {current} (depth {depth})")
-    new_visited = visited_path | {current}
 
-    try:
-        direct_deps = get_deps_func(current, **kwargs)
-        print(f"Dependencies of {current}: {direct_deps}")
-    except Exception as e:
-        print(f"Error getting dependencies for {current}: {str(e)}")
-        processed.add(current)
-        return
-
-    filtered_deps = [dep for dep in direct_deps if not should_skip_package(dep, filter_substring)]
-    graph[current] = filtered_deps
-    print(f"Added to graph: {current} -> {filtered_deps}")
-
-    for dep in filtered_deps:
-        dfs_build_graph(dep, depth + 1, max_depth, filter_substring, new_visited, graph, processed, get_deps_func,
-                        **kwargs)
-    processed.add(current)
+    def fetch_deps(pkg):
+        try:
+            return get_deps_func(pkg, **kwargs)
+        except Exception as e:
+            print(f"Error getting dependencies for {pkg}: {str(e)}")
+            return None
+
+    # Level-synchronous BFS: all packages of one frontier are fetched
+    # concurrently, so wall-clock cost is one round-trip per depth level
+    # instead of one per package.
+    frontier = [root]
+    depth = 0
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        while frontier and depth <= max_depth:
+            results = list(executor.map(fetch_deps, frontier))
+
+            for pkg, direct_deps in zip(frontier, results):
+                print(f"Processing: {pkg} (depth {depth})")
+                if direct_deps is None:
+                    continue
+                print(f"Dependencies of {pkg}: {direct_deps}")
+                filtered_deps = [dep for dep in direct_deps if not should_skip(dep)]
+                graph[pkg] = filtered_deps
+                print(f"Added to graph: {pkg} -> {filtered_deps}")
+
+            next_frontier = []
+            queued = set()
+            for pkg in frontier:
+                for dep in graph.get(pkg, []):
+                    if dep not in graph and dep not in queued:
+                        queued.add(dep)
+                        next_frontier.append(dep)
+
+            frontier = next_frontier
+            depth += 1
 
 
 def topological_sort(graph: dict) -> list:
-    WHITE, GRAY, BLACK = 0, 1, 2
-    color = {node: WHITE for node in graph}
+    # Kahn's algorithm: iterative, O(V + E), no recursion depth limit.
+    # A node's in-degree counts its dependencies present in the graph.
+    # Nodes that never reach in-degree zero sit in (or depend on) a cycle
+    # and are left out of the order, matching the old DFS behavior.
+    in_degree = {node: 0 for node in graph}
+    dependents = {node: [] for node in graph}
+    for node, deps in graph.items():
+        for dep in deps:
+            if dep in in_degree:
+                in_degree[node] += 1
+                dependents[dep].append(node)
+
+    queue = deque(node for node, degree in in_degree.items() if degree == 0)
     result = []
-    in_cycle = set()
-
-    def dfs(node):
-        if color[node] == GRAY:
-            in_cycle.add(node)
-            return False
-        if color[node] == BLACK:
-            return True
-        color[node] = GRAY
-        for dep in graph.get(node, []):
-            if dep not in graph:
-                continue
-            if not dfs(dep):
-                in_cycle.add(node)
-                color[node] = WHITE
-                return False
-        color[node] = BLACK
+    while queue:
+        node = queue.popleft()
         result.append(node)
-        return True
-
-    for node in graph:
-        if color[node] == WHITE:
-            dfs(node)
-    return [node for node in result if node not in in_cycle]
+        for dependent in dependents[node]:
+            in_degree[dependent] -= 1
+            if in_degree[dependent] == 0:
+                queue.append(dependent)
+    return result
 
 
 def generate_d2_code(graph: dict) -> str:
     if not graph:
         return "# Empty dependency graph"
-    lines = []
-    lines.append("// Dependency graph in D2 format")
-    lines.append("direction: right")
-    added = set()
-    for pkg, deps in graph.items():
-        if pkg not in added:
-            lines.append(f'"{pkg}"')
-            added.add(pkg)
-        for dep in deps:
-            if dep not in added:
-                lines.append(f'"{dep}"')
-                added.add(dep)
-            lines.append(f'"{pkg}" -> "{dep}"')
-    return "\n".join(lines)
+
+    # Stream the declarations and edges through a generator straight into
+    # one join; node and edge dedup are both O(1) set lookups, so repeated
+    # dependency entries cannot emit duplicate "A" -> "B" lines.
+    def lines():
+        yield "// Dependency graph in D2 format"
+        yield "direction: right"
+        declared = set()
+        edges = set()
+        for pkg, deps in graph.items():
+            if pkg not in declared:
+                declared.add(pkg)
+                yield f'"{pkg}"'
+            for dep in deps:
+                if dep not in declared:
+                    declared.add(dep)
+                    yield f'"{dep}"'
+                edge = (pkg, dep)
+                if edge not in edges:
+                    edges.add(edge)
+                    yield f'"{pkg}" -> "{dep}"'
+
+    return "\n".join(lines())
 
 
 def parse_arguments():
@@ -193,28 +182,20 @@ def main():
     graph = {}
     if config["mode"] == "test":
         test_repo = load_test_repo(config["repo"])
-        processed = set()
-        dfs_build_graph(
-            current=config["package"],
-            depth=0,
+        bfs_build_graph(
+            root=config["package"],
             max_depth=config["max_depth"],
             filter_substring=config["filter"],
-            visited_path=set(),
             graph=graph,
-            processed=processed,
             get_deps_func=get_test_direct_deps,
             test_repo=test_repo
         )
     else:
-        processed = set()
-        dfs_build_graph(
-            current=config["package"],
-            depth=0,
+        bfs_build_graph(
+            root=config["package"],
             max_depth=config["max_depth"],
             filter_substring=config["filter"],
-            visited_path=set(),
             graph=graph,
-            processed=processed,
             get_deps_func=get_nuget_direct_deps
         )
     print("Dependency graph:")
@@ -251,20 +232,17 @@ def main():
 def export_d2_to_image(d2_code: str, output_name: str):
     try:
         svg_file = output_name + ".svg"
-        d2_file = output_name + ".d2"
-
-        with open(d2_file, "w", encoding="utf-8") as f:
-            f.write(d2_code)
 
+        # d2 reads the diagram from stdin when given "-", so no temp .d2
+        # file has to be written and cleaned up.
         result = subprocess.run(
-            ["d2", d2_file, svg_file],
+            ["d2", "-", svg_file],
+            input=d2_code,
             capture_output=True,
             text=True,
             timeout=15
         )
 
-        os.remove(d2_file)
-
         if result.returncode == 0:
             print(f"Diagram saved to: {svg_file}")
         else: